@@ -3,103 +3,259 @@
 負責從 YouTube 下載音訊，並使用 librosa 進行音高偵測轉換為 MIDI。
 """
 
+import hashlib
+import json
 import os
-import subprocess
-import sys
+import re
+import shutil
+import time
+import traceback
 from pathlib import Path
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import librosa
+import mido
+import numba
 import numpy as np
+import soundfile as sf
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+
+try:
+    # 選用的 Rust 原生分析管線：單趟算完 beats + onsets + pitch，
+    # 沒裝（例如無 Rust 工具鏈的環境）就退回 librosa
+    import sonara
+except ImportError:
+    sonara = None
+
+# 音符集合採 Struct-of-Arrays 形式：四個平行的 NumPy 陣列
+# （pitch: int16, start/end: float64, velocity: int16）
+Notes = namedtuple("Notes", ["pitch", "start", "end", "velocity"])
 
 # yt-dlp 設定
 DOWNLOAD_DIR = Path(__file__).parent / "downloads"
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Krumhansl-Kessler 音調剖面（大調 / 小調），中心化與範數在載入時先算好
+_MAJOR_PROFILE = np.array(
+    [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+)
+_MINOR_PROFILE = np.array(
+    [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+)
+_MAJOR_CENTERED = _MAJOR_PROFILE - _MAJOR_PROFILE.mean()
+_MINOR_CENTERED = _MINOR_PROFILE - _MINOR_PROFILE.mean()
+_MAJOR_NORM = np.linalg.norm(_MAJOR_CENTERED)
+_MINOR_NORM = np.linalg.norm(_MINOR_CENTERED)
+# 環狀相關用的頻域共軛：irfft(rfft(hist) * conj) 一次給出 12 個移調的相關值
+_MAJOR_FFT_CONJ = np.conj(np.fft.rfft(_MAJOR_CENTERED))
+_MINOR_FFT_CONJ = np.conj(np.fft.rfft(_MINOR_CENTERED))
+
 
-def _get_ytdlp_cmd():
-    """取得 yt-dlp 的執行指令（使用 Python 模組呼叫以避免 PATH 問題）。"""
-    return [sys.executable, "-m", "yt_dlp"]
+_VIDEO_ID_RE = re.compile(r"(?:v=|youtu\.be/|shorts/|embed/)([A-Za-z0-9_-]{11})")
+
+
+def _extract_video_id(url: str):
+    """從 YouTube URL 解析影片 ID（watch / youtu.be / shorts / embed）。"""
+    m = _VIDEO_ID_RE.search(url)
+    return m.group(1) if m else None
+
+
+def _find_cached_download(video_id: str):
+    """
+    查詢下載快取：以影片 ID 命名的 metadata sidecar。
+    命中時回傳與 download_youtube_audio 相同格式的 dict，否則回傳 None。
+    """
+    meta_path = DOWNLOAD_DIR / f"{video_id}.json"
+    if not meta_path.exists():
+        return None
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (json.JSONDecodeError, OSError):
+        return None
+
+    file_path = meta.get("file_path", "")
+    if not file_path or not os.path.exists(file_path):
+        return None
+
+    return {
+        "success": True,
+        "file_path": file_path,
+        "title": meta.get("title", "Unknown"),
+        "duration": meta.get("duration", 0),
+        "cached": True,
+    }
+
+
+def _write_download_meta(video_id: str, result: dict):
+    """下載成功後寫入 metadata sidecar，供之後的相同影片請求直接重用。"""
+    meta_path = DOWNLOAD_DIR / f"{video_id}.json"
+    try:
+        meta_path.write_text(
+            json.dumps(
+                {
+                    "file_path": result["file_path"],
+                    "title": result["title"],
+                    "duration": result["duration"],
+                },
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+    except OSError:
+        pass  # 快取寫入失敗不影響本次請求
 
 
-def download_youtube_audio(youtube_url: str) -> dict:
+def download_youtube_audio(youtube_url: str, progress_callback=None) -> dict:
     """
     從 YouTube 連結下載音訊。
 
+    直接呼叫 yt-dlp 的 Python API（免去每次請求重新啟動直譯器、
+    重新 import yt_dlp 的秒級開銷），並取得結構化的回傳值。
     嘗試轉換為 WAV（需要 ffmpeg），若無 ffmpeg 則直接下載原始音訊格式。
 
     Args:
         youtube_url: YouTube 影片的 URL
+        progress_callback: 可選的回呼，收到 yt-dlp 的進度 dict
+            （status / downloaded_bytes / total_bytes 等欄位）
 
     Returns:
         dict: 包含 file_path, title, duration 等資訊
     """
-    import shutil
+    # 先查快取：同一支影片短時間內重複請求（換 key_offset / 輸出格式）很常見
+    video_id = _extract_video_id(youtube_url)
+    if video_id:
+        cached = _find_cached_download(video_id)
+        if cached:
+            return cached
 
     has_ffmpeg = shutil.which("ffmpeg") is not None
-    output_template = str(DOWNLOAD_DIR / "%(id)s.%(ext)s")
-
-    # 建立 yt-dlp 指令
-    cmd = _get_ytdlp_cmd()
 
+    ydl_opts = {
+        "format": "bestaudio/best",
+        "outtmpl": str(DOWNLOAD_DIR / "%(id)s.%(ext)s"),
+        "noplaylist": True,
+        "quiet": True,
+        "no_warnings": True,
+        "socket_timeout": 30,
+    }
     if has_ffmpeg:
-        cmd += ["--extract-audio", "--audio-format", "wav", "--audio-quality", "0"]
-    else:
-        # 無 ffmpeg：直接下載最佳音訊（不轉檔）
-        cmd += ["-f", "bestaudio"]
-
-    cmd += [
-        "--output", output_template,
-        "--print", "after_move:filepath" if has_ffmpeg else "after_filter:filepath",
-        "--print", "%(title)s",
-        "--print", "%(duration)s",
-        "--no-playlist",
-        youtube_url,
-    ]
+        ydl_opts["postprocessors"] = [{
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "wav",
+            "preferredquality": "0",
+        }]
+    if progress_callback is not None:
+        ydl_opts["progress_hooks"] = [progress_callback]
 
     try:
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=300, check=True
-        )
-        lines = result.stdout.strip().split("\n")
-        lines = [l for l in lines if l.strip()]
-
-        if len(lines) >= 3:
-            file_path = lines[-3].strip()
-            title = lines[-2].strip()
-            try:
-                duration = float(lines[-1].strip())
-            except (ValueError, TypeError):
-                duration = 0
-        elif len(lines) >= 1:
-            file_path = lines[0].strip()
-            title = "Unknown"
-            duration = 0
-        else:
-            return {"success": False, "error": "yt-dlp 未產生輸出"}
+        with YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(youtube_url, download=True)
+            if info is None:
+                return {"success": False, "error": "yt-dlp 未取得影片資訊"}
+
+            # 轉檔後的實際路徑在 requested_downloads；退而求其次用模板推算
+            requested = info.get("requested_downloads") or []
+            if requested and requested[0].get("filepath"):
+                file_path = requested[0]["filepath"]
+            else:
+                file_path = ydl.prepare_filename(info)
+                if has_ffmpeg:
+                    file_path = str(Path(file_path).with_suffix(".wav"))
 
-        # 確認檔案存在
+        # 確認檔案存在（單趟 scandir 找最新檔，不必 stat 全部再排序）
         if not os.path.exists(file_path):
-            files = sorted(DOWNLOAD_DIR.glob("*"), key=lambda f: f.stat().st_mtime, reverse=True)
-            if files:
-                file_path = str(files[0])
+            with os.scandir(DOWNLOAD_DIR) as entries:
+                newest = max(
+                    (e for e in entries if e.is_file()),
+                    key=lambda e: e.stat().st_mtime,
+                    default=None,
+                )
+            if newest is not None:
+                file_path = newest.path
             else:
                 return {"success": False, "error": f"找不到下載檔案: {file_path}"}
 
-        return {
+        result_info = {
             "success": True,
             "file_path": file_path,
-            "title": title,
-            "duration": duration,
+            "title": info.get("title", "Unknown"),
+            "duration": float(info.get("duration") or 0),
         }
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr or str(e)
+        if video_id:
+            _write_download_meta(video_id, result_info)
+        return result_info
+    except DownloadError as e:
+        error_msg = str(e)
         if "ffmpeg" in error_msg.lower():
             return {"success": False, "error": "需要安裝 ffmpeg。請執行: winget install ffmpeg"}
         return {"success": False, "error": f"下載失敗: {error_msg[:200]}"}
-    except subprocess.TimeoutExpired:
-        return {"success": False, "error": "下載超時（超過 5 分鐘）"}
 
 
-def audio_to_midi(audio_path: str, output_midi_path: str = None) -> dict:
+def _audio_fingerprint(audio_path: str, extra: str = "") -> str:
+    """
+    計算音訊檔案的快速指紋：檔案大小 + 頭尾各 64 KB 的 blake2b。
+
+    不讀整個檔案，對快取鍵而言已足夠；extra 可混入影響分析結果的參數
+    （例如 pitch_range）。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(audio_path)
+    h.update(str(size).encode())
+    h.update(extra.encode())
+    with open(audio_path, "rb") as f:
+        h.update(f.read(65536))
+        if size > 65536:
+            f.seek(-65536, os.SEEK_END)
+            h.update(f.read(65536))
+    return h.hexdigest()
+
+
+def _load_audio(audio_path: str, target_sr: int = 22050, max_duration: int = 180):
+    """
+    載入音訊為 float32 單聲道，必要時以 soxr 重新取樣。
+
+    以 soundfile 分塊讀取（每次 10 秒），逐塊混為單聲道、重取樣後寫進
+    預先配置好的輸出緩衝；整個過程不會同時存在「整首歌的原始取樣率
+    波形 + 重取樣結果」兩份大陣列。soundfile 不支援的格式
+    （webm/m4a 等）退回 librosa.load。
+    """
+    buf = np.empty(target_sr * max_duration, dtype=np.float32)
+    try:
+        with sf.SoundFile(audio_path) as audio_file:
+            sr_in = audio_file.samplerate
+            pos = 0
+            for block in audio_file.blocks(
+                blocksize=sr_in * 10, dtype="float32", always_2d=True
+            ):
+                mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+                if sr_in != target_sr:
+                    mono = librosa.resample(
+                        mono, orig_sr=sr_in, target_sr=target_sr, res_type="soxr_hq"
+                    )
+                n = min(len(mono), len(buf) - pos)
+                buf[pos:pos + n] = mono[:n]
+                pos += n
+                if pos >= len(buf):
+                    break
+            y = buf[:pos]
+    except (RuntimeError, sf.LibsndfileError):
+        # 非 soundfile 可解的容器 → 交給 librosa（audioread/ffmpeg）
+        y, _ = librosa.load(audio_path, sr=target_sr, mono=True, duration=max_duration)
+        y = y.astype(np.float32, copy=False)[: len(buf)]
+
+    return y, target_sr
+
+
+def audio_to_midi(
+    audio_path: str,
+    output_midi_path: str = None,
+    pitch_range: tuple[str, str] = ("C3", "C6"),
+) -> dict:
     """
     使用 librosa 進行音高偵測，將音訊轉換為 MIDI。
 
@@ -109,6 +265,9 @@ def audio_to_midi(audio_path: str, output_midi_path: str = None) -> dict:
     Args:
         audio_path: 音訊檔案路徑（支援 wav, webm, m4a 等）
         output_midi_path: 輸出 MIDI 檔案路徑
+        pitch_range: pyin 搜尋的音高範圍（音名），預設 C3–C6 涵蓋一般人聲
+            與吉他旋律；含低音內容時可改傳 ("C2", "C7")，但 Viterbi 狀態數
+            隨範圍擴大，速度會明顯變慢
 
     Returns:
         dict: 包含 midi_path、tempo、key 等資訊
@@ -117,17 +276,73 @@ def audio_to_midi(audio_path: str, output_midi_path: str = None) -> dict:
         p = Path(audio_path)
         output_midi_path = str(p.parent / (p.stem + ".mid"))
 
+    # 以音訊指紋查分析快取：同一個檔案重送（換輸出格式等）直接回傳上次結果
     try:
-        import librosa
-        import pretty_midi
+        fingerprint = _audio_fingerprint(audio_path, extra=f"{pitch_range}")
+        meta_path = DOWNLOAD_DIR / f"{fingerprint}.midi.meta.json"
+        if meta_path.exists():
+            cached = json.loads(meta_path.read_text(encoding="utf-8"))
+            if os.path.exists(cached.get("midi_path", "")):
+                return cached
+    except (OSError, json.JSONDecodeError):
+        fingerprint = None
+        meta_path = None
 
+    try:
         print(f"📊 載入音訊: {audio_path}")
-        # 載入音訊（librosa 支援多種格式，會自動用 soundfile 或 audioread）
-        y, sr = librosa.load(audio_path, sr=22050, mono=True, duration=180)
+        y, sr = _load_audio(audio_path, target_sr=22050, max_duration=180)
         print(f"   取樣率: {sr}, 長度: {len(y)/sr:.1f}秒")
 
-        # ── 節拍偵測 ──
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+        hop = 256
+
+        def _run_pyin():
+            # ── 音高偵測 (pyin) ──
+            # pyin 比 piptrack 更適合單旋律偵測；縮小搜尋範圍與 frame 長度
+            # 可大幅降低 Viterbi 解碼成本
+            return librosa.pyin(
+                y, fmin=librosa.note_to_hz(pitch_range[0]),
+                fmax=librosa.note_to_hz(pitch_range[1]),
+                sr=sr,
+                frame_length=1024,
+                hop_length=hop,
+            )
+
+        def _run_rhythm():
+            # ── 單一 STFT：節拍與 onset 偵測都吃同一份頻譜，
+            #    避免各自在內部重算 STFT、重複掃過整段波形 ──
+            stft_mag = np.abs(librosa.stft(y, n_fft=2048, hop_length=hop))
+            onset_env = librosa.onset.onset_strength(
+                S=librosa.power_to_db(stft_mag**2), sr=sr, hop_length=hop
+            )
+            tempo, beat_frames = librosa.beat.beat_track(
+                onset_envelope=onset_env, sr=sr, hop_length=hop
+            )
+            onset_frames = librosa.onset.onset_detect(
+                onset_envelope=onset_env, sr=sr, hop_length=hop, backtrack=True
+            )
+            return tempo, beat_frames, onset_frames
+
+        if sonara is not None:
+            # Rust 管線的 playlist 模式：一次掃過音訊取回節奏與音高
+            analysis = sonara.analyze_file(audio_path, mode="playlist")
+            tempo = analysis["bpm"]
+            beat_frames = np.asarray(analysis.get("beat_frames", []))
+            onset_frames = np.asarray(analysis["onset_frames"])
+            f0, voiced_flag, voiced_probs = sonara.pyin(
+                y,
+                fmin=float(librosa.note_to_hz(pitch_range[0])),
+                fmax=float(librosa.note_to_hz(pitch_range[1])),
+                sr=sr,
+            )
+        else:
+            # pyin 與節拍/onset 互相獨立；librosa 的重活在 numba/NumPy 編譯碼內
+            # 會釋放 GIL，兩條執行緒可以真正並行
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                pyin_future = executor.submit(_run_pyin)
+                rhythm_future = executor.submit(_run_rhythm)
+                tempo, beat_frames, onset_frames = rhythm_future.result()
+                f0, voiced_flag, voiced_probs = pyin_future.result()
+
         # tempo 可能是陣列
         if hasattr(tempo, '__len__'):
             tempo = float(tempo[0]) if len(tempo) > 0 else 120.0
@@ -136,76 +351,47 @@ def audio_to_midi(audio_path: str, output_midi_path: str = None) -> dict:
         tempo = max(60, min(200, tempo))  # 限制合理範圍
         print(f"   偵測 BPM: {tempo:.0f}")
 
-        # ── 音高偵測 (pyin) ──
-        # pyin 比 piptrack 更適合單旋律偵測
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            y, fmin=librosa.note_to_hz('C2'),
-            fmax=librosa.note_to_hz('C7'),
-            sr=sr
-        )
-
-        # 將頻率轉為 MIDI 音高
-        times = librosa.times_like(f0, sr=sr)
-
-        # ── Onset 偵測 ──
-        onset_frames = librosa.onset.onset_detect(y=y, sr=sr, backtrack=True)
-        onset_times = librosa.frames_to_time(onset_frames, sr=sr)
-
-        # ── 建立 MIDI ──
-        midi = pretty_midi.PrettyMIDI(initial_tempo=tempo)
-        melody = pretty_midi.Instrument(program=0, name="Melody")
-        bass_line = pretty_midi.Instrument(program=25, name="Guitar")
+        times = librosa.times_like(f0, sr=sr, hop_length=hop)
+        onset_times = librosa.frames_to_time(onset_frames, sr=sr, hop_length=hop)
 
         # 從 pyin 結果中提取音符
         notes = _extract_notes_from_pyin(f0, voiced_flag, times, onset_times)
-        print(f"   偵測到 {len(notes)} 個音符")
+        note_count = len(notes.pitch)
+        print(f"   偵測到 {note_count} 個音符")
 
-        if len(notes) < 5:
+        if note_count < 5:
             return {
                 "success": False,
                 "error": "偵測到的音符太少，可能是音訊品質不佳或格式不支援"
             }
 
-        for note_info in notes:
-            note = pretty_midi.Note(
-                velocity=int(note_info['velocity']),
-                pitch=int(note_info['pitch']),
-                start=float(note_info['start']),
-                end=float(note_info['end']),
-            )
-            melody.notes.append(note)
-
-        midi.instruments.append(melody)
-
         # 簡單的和弦推論（根據音符分布推估和弦進行）
-        chords = _estimate_chord_progression(notes, tempo)
-        for chord_note in chords:
-            n = pretty_midi.Note(
-                velocity=70,
-                pitch=int(chord_note['pitch']),
-                start=float(chord_note['start']),
-                end=float(chord_note['end']),
-            )
-            bass_line.notes.append(n)
-
-        midi.instruments.append(bass_line)
+        bass_pitches, bass_starts, bass_ends = _estimate_chord_progression(notes, tempo)
 
         # 調性分析
         key = _detect_key(notes)
 
-        midi.write(output_midi_path)
+        # ── 直接以 mido 寫出 MIDI ──
+        _write_midi(output_midi_path, tempo, notes, bass_pitches, bass_starts, bass_ends)
         print(f"   ✅ MIDI 已產生: {output_midi_path}")
 
-        return {
+        result = {
             "success": True,
             "midi_path": output_midi_path,
             "tempo": round(tempo),
             "key": key,
-            "note_count": len(notes),
-            "note": f"使用 librosa pyin 偵測到 {len(notes)} 個音符",
+            "note_count": note_count,
+            "note": f"使用 librosa pyin 偵測到 {note_count} 個音符",
         }
+        if meta_path is not None:
+            try:
+                meta_path.write_text(
+                    json.dumps(result, ensure_ascii=False), encoding="utf-8"
+                )
+            except OSError:
+                pass  # 快取寫入失敗不影響本次請求
+        return result
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return {
             "success": False,
@@ -213,116 +399,203 @@ def audio_to_midi(audio_path: str, output_midi_path: str = None) -> dict:
         }
 
 
+@numba.njit(cache=True, fastmath=True)
+def _extract_notes_numba(midi_arr, valid, times, onsets, min_dur):
+    """
+    音符切分核心（nopython 編譯）。
+
+    逐 frame 走訪已量化的 MIDI 音高（頻率轉換已在外層向量化完成），
+    將連續相同音高合併為音符；onsets 已排序，以雙指標掃描取代每 frame
+    的線性搜尋。回傳預先配置好的四個平行陣列
+    （pitch / start / end / velocity）與實際音符數。
+    """
+    n = len(midi_arr)
+    pitches = np.empty(n, np.int16)
+    starts = np.empty(n, np.float64)
+    ends = np.empty(n, np.float64)
+    velocities = np.empty(n, np.int16)
+    count = 0
+
+    cur_pitch = -1
+    cur_start = 0.0
+    oi = 0
+    m = len(onsets)
+
+    for i in range(n):
+        t = times[i]
+        if valid[i]:
+            p = midi_arr[i]
+
+            # onsets 單調遞增 → 指標只會前進
+            while oi < m and onsets[oi] < t - 0.05:
+                oi += 1
+            is_onset = oi < m and onsets[oi] - t < 0.05
+
+            if cur_pitch == -1:
+                cur_pitch = p
+                cur_start = t
+            elif p != cur_pitch or is_onset:
+                dur = t - cur_start
+                if dur >= min_dur:
+                    v = 80 + int((dur - 0.1) * 40.0)
+                    if v < 60:
+                        v = 60
+                    elif v > 120:
+                        v = 120
+                    pitches[count] = cur_pitch
+                    starts[count] = cur_start
+                    ends[count] = t
+                    velocities[count] = v
+                    count += 1
+                cur_pitch = p
+                cur_start = t
+        else:
+            if cur_pitch != -1:
+                dur = t - cur_start
+                if dur >= min_dur:
+                    v = 80 + int((dur - 0.1) * 40.0)
+                    if v < 60:
+                        v = 60
+                    elif v > 120:
+                        v = 120
+                    pitches[count] = cur_pitch
+                    starts[count] = cur_start
+                    ends[count] = t
+                    velocities[count] = v
+                    count += 1
+                cur_pitch = -1
+
+    # 收尾最後一個音符
+    if cur_pitch != -1 and n > 0:
+        dur = times[n - 1] - cur_start
+        if dur >= min_dur:
+            v = 80 + int((dur - 0.1) * 40.0)
+            if v < 60:
+                v = 60
+            elif v > 120:
+                v = 120
+            pitches[count] = cur_pitch
+            starts[count] = cur_start
+            ends[count] = times[n - 1]
+            velocities[count] = v
+            count += 1
+
+    return pitches[:count], starts[:count], ends[:count], velocities[:count]
+
+
 def _extract_notes_from_pyin(f0, voiced_flag, times, onset_times):
     """
-    從 pyin 的結果提取音符列表。
+    從 pyin 的結果提取音符，回傳 Notes（四個平行陣列）。
 
     將連續的相同音高合併為一個音符，配合 onset 偵測確定音符邊界。
+    實際切分工作在 _extract_notes_numba（numba 編譯）中完成。
     """
-    notes = []
-    current_pitch = None
-    current_start = None
     min_duration = 0.08  # 最短音符長度（秒）
 
-    for i in range(len(f0)):
-        if voiced_flag[i] and not np.isnan(f0[i]):
-            midi_pitch = int(round(librosa_hz_to_midi(f0[i])))
-            midi_pitch = max(21, min(108, midi_pitch))  # 鋼琴範圍
+    f0 = np.ascontiguousarray(f0, dtype=np.float64)
+    times = np.ascontiguousarray(times, dtype=np.float64)
+    voiced = np.ascontiguousarray(voiced_flag, dtype=np.bool_)
+    onsets = np.ascontiguousarray(onset_times, dtype=np.float64)
 
-            # 檢查是否有新的 onset
-            is_new_onset = False
-            for onset_t in onset_times:
-                if abs(times[i] - onset_t) < 0.05:
-                    is_new_onset = True
-                    break
+    if len(f0) == 0:
+        empty = np.empty(0)
+        return Notes(empty.astype(np.int16), empty, empty, empty.astype(np.int16))
 
-            if current_pitch is None:
-                # 新音符開始
-                current_pitch = midi_pitch
-                current_start = times[i]
-            elif midi_pitch != current_pitch or is_new_onset:
-                # 音高改變或新 onset → 結束前一個音符
-                duration = times[i] - current_start
-                if duration >= min_duration:
-                    velocity = min(120, max(60, 80 + int((duration - 0.1) * 40)))
-                    notes.append({
-                        'pitch': current_pitch,
-                        'start': current_start,
-                        'end': times[i],
-                        'velocity': velocity,
-                    })
-                current_pitch = midi_pitch
-                current_start = times[i]
-        else:
-            # 無聲區段 → 結束當前音符
-            if current_pitch is not None:
-                duration = times[i] - current_start
-                if duration >= min_duration:
-                    velocity = min(120, max(60, 80))
-                    notes.append({
-                        'pitch': current_pitch,
-                        'start': current_start,
-                        'end': times[i],
-                        'velocity': velocity,
-                    })
-                current_pitch = None
-                current_start = None
-
-    # 處理最後一個音符
-    if current_pitch is not None and current_start is not None:
-        end_time = times[-1] if len(times) > 0 else current_start + 0.25
-        duration = end_time - current_start
-        if duration >= min_duration:
-            notes.append({
-                'pitch': current_pitch,
-                'start': current_start,
-                'end': end_time,
-                'velocity': 80,
-            })
-
-    return notes
+    # 頻率 → MIDI 一次向量化算完（librosa.hz_to_midi 是 C 層迴圈），
+    # 量化並夾在鋼琴音域後再交給切分核心
+    valid = voiced & ~np.isnan(f0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        midi_float = librosa.hz_to_midi(f0)
+    midi_arr = np.where(
+        valid, np.clip(np.round(midi_float), 21, 108), 0
+    ).astype(np.int16)
+
+    pitches, starts, ends, velocities = _extract_notes_numba(
+        midi_arr, valid, times, onsets, min_duration
+    )
+    return Notes(pitches, starts, ends, velocities)
+
+
+def _write_midi(path, tempo, melody_notes, bass_pitches, bass_starts, bass_ends):
+    """
+    直接以 mido 寫出雙音軌 MIDI（旋律 + 低音）。
+
+    繞過 pretty_midi 寫檔時的純 Python tick 換算與驗證層：
+    秒 → tick 的轉換先向量化算好，單趟走訪排好序的事件即可得 delta time。
+    """
+    ticks_per_beat = 480
+    scale = tempo * ticks_per_beat / 60.0  # 秒 → tick
+
+    def _build_track(name, program, channel, pitches, on_ticks, off_ticks, velocities):
+        # note_off 排在同 tick 的 note_on 之前，避免零長度重疊
+        events = sorted(
+            [(t, 1, p, v) for p, t, v in zip(pitches, on_ticks, velocities)]
+            + [(t, 0, p, 0) for p, t in zip(pitches, off_ticks)]
+        )
+        track = mido.MidiTrack()
+        track.append(mido.MetaMessage("track_name", name=name, time=0))
+        track.append(mido.Message("program_change", program=program, channel=channel, time=0))
+        prev = 0
+        for tick, kind, pitch, velocity in events:
+            track.append(mido.Message(
+                "note_on" if kind else "note_off",
+                note=pitch, velocity=velocity, channel=channel, time=tick - prev,
+            ))
+            prev = tick
+        track.append(mido.MetaMessage("end_of_track", time=0))
+        return track
+
+    midi_file = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+
+    tempo_track = mido.MidiTrack()
+    tempo_track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(tempo), time=0))
+    tempo_track.append(mido.MetaMessage("end_of_track", time=0))
+    midi_file.tracks.append(tempo_track)
+
+    midi_file.tracks.append(_build_track(
+        "Melody", 0, 0,
+        melody_notes.pitch.tolist(),
+        np.rint(melody_notes.start * scale).astype(np.int64).tolist(),
+        np.rint(melody_notes.end * scale).astype(np.int64).tolist(),
+        melody_notes.velocity.tolist(),
+    ))
+    midi_file.tracks.append(_build_track(
+        "Guitar", 25, 1,
+        bass_pitches.tolist(),
+        np.rint(bass_starts * scale).astype(np.int64).tolist(),
+        np.rint(bass_ends * scale).astype(np.int64).tolist(),
+        [70] * len(bass_pitches),
+    ))
+
+    midi_file.save(path)
 
 
 def _estimate_chord_progression(notes, tempo):
     """
     根據旋律音符簡單推估和弦進行。
-    每小節取該小節中出現頻率最高的音做為根音。
+    每小節取該小節中出現頻率最高的音做為根音，回傳 (pitch, start, end) 三個陣列。
     """
-    if not notes:
-        return []
+    if len(notes.pitch) == 0:
+        return np.empty(0, np.int16), np.empty(0), np.empty(0)
 
     beat_duration = 60.0 / tempo
     bar_duration = beat_duration * 4  # 4/4 拍
-    total_duration = max(n['end'] for n in notes)
-    chord_notes = []
-
-    # 常見和弦根音對照
-    for bar_start in np.arange(0, total_duration, bar_duration):
-        bar_end = bar_start + bar_duration
-        # 收集此小節的音高
-        pitches_in_bar = []
-        for n in notes:
-            if n['start'] >= bar_start and n['start'] < bar_end:
-                pitches_in_bar.append(n['pitch'] % 12)
-
-        if not pitches_in_bar:
-            continue
-
-        # 找到出現最多次的音作為根音
-        pitch_counts = {}
-        for p in pitches_in_bar:
-            pitch_counts[p] = pitch_counts.get(p, 0) + 1
-        root = max(pitch_counts, key=pitch_counts.get)
-
-        # 加入根音（低一個八度）
-        bass_pitch = 36 + root  # C2 起
-        chord_notes.append({
-            'pitch': bass_pitch,
-            'start': bar_start,
-            'end': bar_end,
-        })
-
-    return chord_notes
+    total_duration = float(notes.end.max())
+    pitch_classes = notes.pitch % 12
+
+    # 每個音符指派到小節，(n_bars, 12) 直方圖一次累加完，argmax 取各小節根音
+    n_bars = int(total_duration // bar_duration) + 1
+    bar_idx = np.minimum((notes.start // bar_duration).astype(np.int64), n_bars - 1)
+    hist = np.zeros((n_bars, 12), dtype=np.int64)
+    np.add.at(hist, (bar_idx, pitch_classes), 1)
+
+    nonempty = np.flatnonzero(hist.sum(axis=1) > 0)
+    roots = hist[nonempty].argmax(axis=1)
+
+    # 根音低八度（C2 起）
+    pitches = (36 + roots).astype(np.int16)
+    starts = nonempty * bar_duration
+    return pitches, starts, starts + bar_duration
 
 
 def _detect_key(notes):
@@ -330,59 +603,56 @@ def _detect_key(notes):
     根據音符分布偵測調性。
     使用 Krumhansl-Kessler 音調剖面（簡化版）。
     """
-    if not notes:
+    if len(notes.pitch) == 0:
         return "C"
 
-    NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
-
-    # 計算各音名出現次數
-    pitch_histogram = [0] * 12
-    for n in notes:
-        pitch_class = n['pitch'] % 12
-        duration = n['end'] - n['start']
-        pitch_histogram[pitch_class] += duration
+    # 各音名的累計時值（一次 bincount 取代逐音符迴圈）
+    durations = notes.end - notes.start
+    pitch_histogram = np.bincount(notes.pitch % 12, weights=durations, minlength=12)
 
-    # 大調的 Krumhansl-Kessler profile
-    major_profile = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+    hc = pitch_histogram - pitch_histogram.mean()
+    denom = np.linalg.norm(hc) + 1e-12
 
-    # 嘗試每個調
-    best_key = "C"
-    best_corr = -1
+    # FFT 環狀相關：一對 rfft/irfft 算完 12 個移調，免去逐一 roll
+    hc_fft = np.fft.rfft(hc)
+    major_corrs = np.fft.irfft(hc_fft * _MAJOR_FFT_CONJ, n=12) / (denom * _MAJOR_NORM)
+    minor_corrs = np.fft.irfft(hc_fft * _MINOR_FFT_CONJ, n=12) / (denom * _MINOR_NORM)
 
-    for shift in range(12):
-        shifted = pitch_histogram[shift:] + pitch_histogram[:shift]
-        # 計算相關係數
-        mean_s = sum(shifted) / 12
-        mean_p = sum(major_profile) / 12
-        numerator = sum((s - mean_s) * (p - mean_p) for s, p in zip(shifted, major_profile))
-        denom_s = sum((s - mean_s) ** 2 for s in shifted) ** 0.5
-        denom_p = sum((p - mean_p) ** 2 for p in major_profile) ** 0.5
+    best_major = int(np.argmax(major_corrs))
+    best_minor = int(np.argmax(minor_corrs))
 
-        if denom_s > 0 and denom_p > 0:
-            corr = numerator / (denom_s * denom_p)
-            if corr > best_corr:
-                best_corr = corr
-                best_key = NOTE_NAMES[shift]
+    if minor_corrs[best_minor] > major_corrs[best_major]:
+        return NOTE_NAMES[best_minor] + "m"
+    return NOTE_NAMES[best_major]
 
-    return best_key
 
+# 保持向後相容
+audio_to_midi_basic = audio_to_midi
 
-def librosa_hz_to_midi(freq):
-    """將頻率 (Hz) 轉換為 MIDI 音高。"""
-    if freq <= 0:
-        return 0
-    return 69 + 12 * np.log2(freq / 440.0)
 
+def warmup():
+    """
+    預熱分析管線：用一小段靜音觸發 librosa / numba 的 JIT 編譯。
 
-# 保持向後相容
-audio_to_midi_basic = audio_to_midi
+    librosa 內部與 _extract_notes_numba 的編譯成本有數秒之譜，
+    在伺服器啟動時付掉，第一個真實請求就不用等。
+    """
+    y = np.zeros(8192, dtype=np.float32)
+    f0, voiced, _ = librosa.pyin(
+        y, fmin=65.4, fmax=2093.0, sr=22050, frame_length=1024, hop_length=256
+    )
+    times = librosa.times_like(f0, sr=22050, hop_length=256)
+    _extract_notes_from_pyin(f0, voiced, times, np.empty(0))
+    librosa.beat.beat_track(
+        onset_envelope=librosa.onset.onset_strength(y=y, sr=22050), sr=22050
+    )
 
 
 def cleanup_downloads(max_age_hours: int = 24):
     """清理超過指定時間的下載檔案。"""
-    import time
-
     now = time.time()
-    for f in DOWNLOAD_DIR.iterdir():
-        if f.is_file() and (now - f.stat().st_mtime) > max_age_hours * 3600:
-            f.unlink()
+    max_age = max_age_hours * 3600
+    with os.scandir(DOWNLOAD_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and (now - entry.stat().st_mtime) > max_age:
+                os.unlink(entry.path)
@@ -3,7 +3,9 @@ Music Tab Finder - FastAPI 後端
 提供 YouTube 轉譜的 REST API。
 """
 
+import asyncio
 import os
+import traceback
 import uuid
 import json
 from pathlib import Path
@@ -14,6 +16,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
+import audio_processor
 from audio_processor import download_youtube_audio, audio_to_midi_basic, DOWNLOAD_DIR
 from tab_engine import generate_chord_sheet, generate_fingerstyle_tab, generate_piano_sheet
 
@@ -34,9 +37,16 @@ app.add_middleware(
 
 # ── 資料儲存 ──
 HISTORY_FILE = Path(__file__).parent / "history.json"
+HISTORY_LOG = Path(__file__).parent / "history.ndjson"
 FAVORITES_FILE = Path(__file__).parent / "favorites.json"
 FRONTEND_DIR = Path(__file__).parent.parent / "frontend"
 
+MAX_HISTORY = 50         # 只保留最近 50 筆
+_COMPACT_THRESHOLD = 100  # 記錄檔累積超過此行數時壓縮回快照
+
+# 保護 history / favorites 檔案在並行請求下不被交錯寫入
+_store_lock = asyncio.Lock()
+
 
 def load_json(path: Path) -> list:
     """載入 JSON 檔案。"""
@@ -52,6 +62,46 @@ def save_json(path: Path, data: list):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def load_history() -> list:
+    """
+    讀取歷史記錄：append-only 記錄檔（較新）+ 快照，新的在前。
+    """
+    records = []
+    if HISTORY_LOG.exists():
+        with open(HISTORY_LOG, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # 跳過寫到一半的行
+    records.reverse()  # 檔尾最新 → 反轉成新的在前
+    records.extend(load_json(HISTORY_FILE))
+    return records[:MAX_HISTORY]
+
+
+def append_history(record: dict):
+    """
+    新記錄只 append 一行到記錄檔，不重寫整份歷史；
+    記錄檔長到門檻時壓縮成快照重新開始。
+    """
+    with open(HISTORY_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    with open(HISTORY_LOG, "r", encoding="utf-8") as f:
+        log_lines = sum(1 for _ in f)
+    if log_lines >= _COMPACT_THRESHOLD:
+        compact_history()
+
+
+def compact_history():
+    """把記錄檔合併進 history.json 快照並清空記錄檔。"""
+    save_json(HISTORY_FILE, load_history())
+    if HISTORY_LOG.exists():
+        HISTORY_LOG.unlink()
+
+
 # ── 請求模型 ──
 class TranscribeRequest(BaseModel):
     """轉譜請求。"""
@@ -60,11 +110,25 @@ class TranscribeRequest(BaseModel):
     key_offset: int = 0  # 調號偏移
 
 
+class BatchTranscribeRequest(BaseModel):
+    """批次轉譜請求。"""
+    youtube_urls: list[str]
+    output_type: str = "chord_sheet"
+    key_offset: int = 0
+
+
 class FavoriteRequest(BaseModel):
     """收藏請求。"""
     record_id: str
 
 
+@app.on_event("startup")
+async def _warmup():
+    """啟動時壓縮歷史記錄檔，並在背景預熱 librosa / numba JIT。"""
+    compact_history()
+    asyncio.create_task(asyncio.to_thread(audio_processor.warmup))
+
+
 # ── API 路由 ──
 @app.get("/api/status")
 async def api_status():
@@ -76,6 +140,61 @@ async def api_status():
     }
 
 
+async def _transcribe_one(youtube_url: str, output_type: str, key_offset: int) -> dict:
+    """
+    執行單一轉譜流程並寫入歷史記錄。
+
+    下載（網路 I/O）與分析／產譜（CPU 密集）都移到 worker thread，
+    避免阻塞事件迴圈。
+    """
+    # Step 1: 下載 YouTube 音訊
+    download_result = await asyncio.to_thread(download_youtube_audio, youtube_url)
+    if not download_result["success"]:
+        raise HTTPException(status_code=400, detail=download_result.get("error", "下載失敗"))
+
+    wav_path = download_result["file_path"]
+    title = download_result.get("title", "Unknown")
+
+    # Step 2: 音訊轉 MIDI
+    midi_result = await asyncio.to_thread(audio_to_midi_basic, wav_path)
+    if not midi_result["success"]:
+        raise HTTPException(status_code=500, detail=midi_result.get("error", "轉譜失敗"))
+
+    midi_path = midi_result["midi_path"]
+
+    # Step 3: 產生樂譜
+    if output_type == "chord_sheet":
+        sheet_result = await asyncio.to_thread(generate_chord_sheet, midi_path, key_offset)
+    elif output_type == "fingerstyle_tab":
+        sheet_result = await asyncio.to_thread(generate_fingerstyle_tab, midi_path)
+    elif output_type == "piano_sheet":
+        sheet_result = await asyncio.to_thread(generate_piano_sheet, midi_path, key_offset)
+    else:
+        raise HTTPException(status_code=400, detail=f"不支援的輸出類型: {output_type}")
+
+    if not sheet_result["success"]:
+        raise HTTPException(status_code=500, detail=sheet_result.get("error", "樂譜產生失敗"))
+
+    # 建立記錄
+    record = {
+        "id": str(uuid.uuid4()),
+        "youtube_url": youtube_url,
+        "title": title,
+        "output_type": output_type,
+        "content": sheet_result["content"],
+        "tempo": sheet_result.get("tempo", 120),
+        "key": sheet_result.get("key", "C"),
+        "created_at": datetime.now().isoformat(),
+        "midi_note": midi_result.get("note", ""),
+    }
+
+    # 儲存歷史記錄（append-only，滿了才壓縮）
+    async with _store_lock:
+        append_history(record)
+
+    return record
+
+
 @app.post("/api/transcribe")
 async def transcribe(request: TranscribeRequest):
     """
@@ -86,57 +205,10 @@ async def transcribe(request: TranscribeRequest):
     2. 轉換為 MIDI
     3. 產生指定格式的樂譜
     """
-    import traceback
-
     try:
-        # Step 1: 下載 YouTube 音訊
-        download_result = download_youtube_audio(request.youtube_url)
-        if not download_result["success"]:
-            raise HTTPException(status_code=400, detail=download_result.get("error", "下載失敗"))
-
-        wav_path = download_result["file_path"]
-        title = download_result.get("title", "Unknown")
-
-        # Step 2: 音訊轉 MIDI
-        midi_result = audio_to_midi_basic(wav_path)
-        if not midi_result["success"]:
-            raise HTTPException(status_code=500, detail=midi_result.get("error", "轉譜失敗"))
-
-        midi_path = midi_result["midi_path"]
-
-        # Step 3: 產生樂譜
-        if request.output_type == "chord_sheet":
-            sheet_result = generate_chord_sheet(midi_path, request.key_offset)
-        elif request.output_type == "fingerstyle_tab":
-            sheet_result = generate_fingerstyle_tab(midi_path)
-        elif request.output_type == "piano_sheet":
-            sheet_result = generate_piano_sheet(midi_path, request.key_offset)
-        else:
-            raise HTTPException(status_code=400, detail=f"不支援的輸出類型: {request.output_type}")
-
-        if not sheet_result["success"]:
-            raise HTTPException(status_code=500, detail=sheet_result.get("error", "樂譜產生失敗"))
-
-        # 建立記錄
-        record = {
-            "id": str(uuid.uuid4()),
-            "youtube_url": request.youtube_url,
-            "title": title,
-            "output_type": request.output_type,
-            "content": sheet_result["content"],
-            "tempo": sheet_result.get("tempo", 120),
-            "key": sheet_result.get("key", "C"),
-            "created_at": datetime.now().isoformat(),
-            "midi_note": midi_result.get("note", ""),
-        }
-
-        # 儲存歷史記錄
-        history = load_json(HISTORY_FILE)
-        history.insert(0, record)
-        history = history[:50]  # 只保留最近 50 筆
-        save_json(HISTORY_FILE, history)
-
-        return record
+        return await _transcribe_one(
+            request.youtube_url, request.output_type, request.key_offset
+        )
     except HTTPException:
         raise  # 讓 FastAPI 處理已知的 HTTP 異常
     except Exception as e:
@@ -144,29 +216,54 @@ async def transcribe(request: TranscribeRequest):
         raise HTTPException(status_code=500, detail=f"轉譜過程發生錯誤: {str(e)}")
 
 
+@app.post("/api/transcribe/batch")
+async def transcribe_batch(request: BatchTranscribeRequest):
+    """
+    批次轉譜 API：並行處理多個 YouTube 連結。
+    個別失敗不會中斷整批，結果依輸入順序回傳。
+    """
+    tasks = [
+        _transcribe_one(url, request.output_type, request.key_offset)
+        for url in request.youtube_urls
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    items = []
+    for url, result in zip(request.youtube_urls, results):
+        if isinstance(result, HTTPException):
+            items.append({"youtube_url": url, "success": False, "error": result.detail})
+        elif isinstance(result, Exception):
+            items.append({"youtube_url": url, "success": False, "error": str(result)})
+        else:
+            items.append({"youtube_url": url, "success": True, "record": result})
+
+    return {"results": items}
+
+
 @app.get("/api/history")
 async def get_history():
     """取得轉譜歷史記錄。"""
-    return load_json(HISTORY_FILE)
+    return load_history()
 
 
 @app.post("/api/favorites")
 async def add_favorite(request: FavoriteRequest):
     """將記錄加入收藏。"""
-    history = load_json(HISTORY_FILE)
-    record = next((r for r in history if r["id"] == request.record_id), None)
+    async with _store_lock:
+        history = load_history()
+        record = next((r for r in history if r["id"] == request.record_id), None)
 
-    if not record:
-        raise HTTPException(status_code=404, detail="找不到該記錄")
+        if not record:
+            raise HTTPException(status_code=404, detail="找不到該記錄")
 
-    favorites = load_json(FAVORITES_FILE)
+        favorites = load_json(FAVORITES_FILE)
 
-    # 避免重複收藏
-    if any(f["id"] == request.record_id for f in favorites):
-        return {"message": "已經收藏過了", "favorites": favorites}
+        # 避免重複收藏
+        if any(f["id"] == request.record_id for f in favorites):
+            return {"message": "已經收藏過了", "favorites": favorites}
 
-    favorites.insert(0, record)
-    save_json(FAVORITES_FILE, favorites)
+        favorites.insert(0, record)
+        save_json(FAVORITES_FILE, favorites)
 
     return {"message": "收藏成功", "favorites": favorites}
 
@@ -180,9 +277,10 @@ async def get_favorites():
 @app.delete("/api/favorites/{record_id}")
 async def remove_favorite(record_id: str):
     """取消收藏。"""
-    favorites = load_json(FAVORITES_FILE)
-    favorites = [f for f in favorites if f["id"] != record_id]
-    save_json(FAVORITES_FILE, favorites)
+    async with _store_lock:
+        favorites = load_json(FAVORITES_FILE)
+        favorites = [f for f in favorites if f["id"] != record_id]
+        save_json(FAVORITES_FILE, favorites)
     return {"message": "已取消收藏", "favorites": favorites}
 
 
@@ -192,7 +290,7 @@ async def export_to_static():
     匯出歷史記錄到前端靜態資料檔案。
     供 GitHub Pages 部署使用。
     """
-    history = load_json(HISTORY_FILE)
+    history = load_history()
     favorites = load_json(FAVORITES_FILE)
 
     # 合併歷史與收藏（去重）
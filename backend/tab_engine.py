@@ -3,9 +3,26 @@
 負責將 MIDI 資訊轉換為吉他簡譜（彈唱）與指彈六線譜。
 """
 
+import os
+
+import numpy as np
 import pretty_midi
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Optional
 
+# numba 只是加速手段，沒裝時退回純 NumPy 的分段歸約版本
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# symusic（C++ 解析器）比 pretty_midi 快上百倍，有裝就優先用
+try:
+    import symusic
+except ImportError:
+    symusic = None
+
 
 # ── 音符名稱對照表 ──
 NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
@@ -14,8 +31,19 @@ NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
 # C=1, D=2, E=3, F=4, G=5, A=6, B=7
 NUMBERED_NOTATION_MAP = {0: "1", 2: "2", 4: "3", 5: "4", 7: "5", 9: "6", 11: "7"}
 
+# ── 簡譜查表（批次轉換用）──
+# _NUM_LUT[pc]：音級 pc 的簡譜數字（升記號 fallback 已展開）
+_NUM_LUT = [
+    NUMBERED_NOTATION_MAP.get(pc)
+    or (NUMBERED_NOTATION_MAP[pc - 1] + "#" if (pc - 1) in NUMBERED_NOTATION_MAP else str(pc))
+    for pc in range(12)
+]
+# _OCT_LUT[octave]：八度標記字串（高八度加點、低八度加逗號）
+_OCT_LUT = {o: "·" * o if o > 0 else "," * (-o) for o in range(-6, 7)}
+
 # ── 吉他標準調弦 (E2, A2, D3, G3, B3, E4) ──
 GUITAR_TUNING = [40, 45, 50, 55, 59, 64]
+_TUNING = np.array(GUITAR_TUNING, dtype=np.int16)  # 廣播用，模組載入時建一次
 GUITAR_STRING_NAMES = ["e", "B", "G", "D", "A", "E"]  # 第1弦到第6弦
 
 
@@ -37,6 +65,18 @@ CHORD_TEMPLATES = {
     "Bm": [11, 2, 6],
 }
 
+# 和弦模板的 12-bit 位元遮罩版（bit i = 音級 i 在和弦內），
+# 比對時只需整數 AND + popcount，不必逐音級查字典
+CHORD_NAMES = list(CHORD_TEMPLATES)
+CHORD_MASKS = np.array(
+    [sum(1 << pc for pc in tmpl) for tmpl in CHORD_TEMPLATES.values()],
+    dtype=np.uint16,
+)
+
+# 遮罩 → 和弦名稱的完全比對表：乾淨的三和弦直接 O(1) 查到，
+# 模糊計分只留給有多餘音或缺音的拍
+_EXACT = {int(mask): name for name, mask in zip(CHORD_NAMES, CHORD_MASKS.tolist())}
+
 
 def midi_note_to_name(midi_note: int) -> str:
     """將 MIDI 音符編號轉換為音符名稱（如 C4, D#5）。"""
@@ -45,10 +85,14 @@ def midi_note_to_name(midi_note: int) -> str:
     return f"{note_name}{octave}"
 
 
+@lru_cache(maxsize=2048)
 def midi_note_to_numbered(midi_note: int, key_offset: int = 0) -> str:
     """
     將 MIDI 音符轉換為簡譜數字表示。
 
+    數字與八度標記都查預建的字串表（見 _NUM_LUT / _OCT_LUT），
+    輸入只有 128 個音高 × 少數調號，結果直接 lru_cache。
+
     Args:
         midi_note: MIDI 音符編號 (0-127)
         key_offset: 調號偏移（0=C 大調）
@@ -58,25 +102,23 @@ def midi_note_to_numbered(midi_note: int, key_offset: int = 0) -> str:
     """
     note_in_scale = (midi_note - key_offset) % 12
     octave = (midi_note - 60) // 12  # 以 C4 為中心
+    return _NUM_LUT[note_in_scale] + _OCT_LUT[octave]
 
-    # 查找最接近的簡譜數字
-    if note_in_scale in NUMBERED_NOTATION_MAP:
-        num = NUMBERED_NOTATION_MAP[note_in_scale]
-    else:
-        # 升降音用 # 或 b 標記
-        lower = note_in_scale - 1
-        if lower in NUMBERED_NOTATION_MAP:
-            num = NUMBERED_NOTATION_MAP[lower] + "#"
-        else:
-            num = str(note_in_scale)
 
-    # 八度標記
-    if octave > 0:
-        num = num + "·" * octave  # 高八度加點
-    elif octave < 0:
-        num = num + "," * abs(octave)  # 低八度加逗號
+def midi_notes_to_numbered(pitches, key_offset: int = 0) -> list[str]:
+    """
+    批次版 midi_note_to_numbered：一次轉換整個音高陣列。
 
-    return num
+    音級與八度先以 NumPy 算好，再查預建的字串表組合；
+    負數音高（空拍 sentinel）會回傳 "-"。
+    """
+    pitches = np.asarray(pitches)
+    idx = ((pitches - key_offset) % 12).tolist()
+    octaves = ((pitches - 60) // 12).tolist()
+    return [
+        (_NUM_LUT[i] + _OCT_LUT[o]) if p >= 0 else "-"
+        for p, i, o in zip(pitches.tolist(), idx, octaves)
+    ]
 
 
 def detect_chord(notes: list[int]) -> str:
@@ -92,18 +134,231 @@ def detect_chord(notes: list[int]) -> str:
     if not notes:
         return ""
 
-    pitch_classes = sorted(set(n % 12 for n in notes))
+    # 音級集合壓成 12-bit 遮罩，再用 AND + popcount 對每個模板計分
+    mask = 0
+    for n in notes:
+        mask |= 1 << (n % 12)
 
-    best_match = ""
+    # 常見情況：音級集合剛好就是某個模板
+    exact = _EXACT.get(mask)
+    if exact:
+        return exact
+
+    best_idx = -1
     best_score = 0
 
-    for chord_name, template in CHORD_TEMPLATES.items():
-        score = sum(1 for pc in pitch_classes if pc in template)
+    for i, tmpl in enumerate(CHORD_MASKS.tolist()):
+        score = (tmpl & mask).bit_count()
         if score > best_score:
             best_score = score
-            best_match = chord_name
+            best_idx = i
+
+    return CHORD_NAMES[best_idx] if best_score >= 2 else ""
+
+
+def _segment_reduce(ufunc, values, seg_idx, out):
+    """
+    對已排序資料做分段歸約：seg_idx 是 searchsorted 出的每段起點
+    （長度 = 段數 + 1），空段保留 out 原本的 sentinel 值。
+
+    reduceat 對空段會直接回傳該位置的元素，所以只對非空段歸約。
+    """
+    counts = np.diff(seg_idx)
+    nonempty = np.flatnonzero(counts)
+    if nonempty.size:
+        out[nonempty] = ufunc.reduceat(values, seg_idx[nonempty])
+    return out
+
+
+def _sweep_all_np(starts, pitches, beat_duration, total_beats, total_columns,
+                  chord_masks, tuning):
+    """
+    純 NumPy 版融合掃描（無 numba 時的後援），輸出與編譯版相同。
+
+    每拍的最高音／左右手音高用 reduceat 分段歸約，
+    和弦計分用 (拍數, 模板數) 廣播 + np.bitwise_count 一次算完，
+    六線譜品位網格用向量化弦品映射 + fancy indexing 填入。
+    """
+    boundaries = np.arange(total_beats + 1) * beat_duration
+
+    top = np.full(total_beats, -1, dtype=np.int16)
+    seg_idx = np.searchsorted(starts, boundaries)
+    _segment_reduce(np.maximum, pitches, seg_idx, top)
+
+    # 左右手各自在過濾後的子陣列上再切一次段
+    hi = pitches >= 60
+    rh = np.full(total_beats, -1, dtype=np.int16)
+    _segment_reduce(np.maximum, pitches[hi], np.searchsorted(starts[hi], boundaries), rh)
+
+    lo = ~hi
+    lh = np.full(total_beats, -1, dtype=np.int16)
+    _segment_reduce(np.minimum, pitches[lo], np.searchsorted(starts[lo], boundaries), lh)
+
+    # 每拍的 12-bit 音級遮罩：逐音遮罩分段 OR，再對全部模板廣播計分
+    note_masks = np.int64(1) << (pitches % 12).astype(np.int64)
+    beat_masks = np.zeros(total_beats, dtype=np.int64)
+    _segment_reduce(np.bitwise_or, note_masks, seg_idx, beat_masks)
 
-    return best_match if best_score >= 2 else ""
+    scores = np.bitwise_count(beat_masks[:, None] & chord_masks[None, :].astype(np.int64))
+    best = scores.argmax(axis=1)
+    best_score = scores.max(axis=1, initial=0)
+    chord_idx = np.where(best_score >= 2, best, -1).astype(np.int8)
+
+    # 六線譜品位網格（-1 = 空格）
+    fret_grid = np.full((6, total_columns), -1, dtype=np.int8)
+    strings, frets, playable = midi_note_to_guitar_fret_vec(pitches)
+    cols = (starts / beat_duration).astype(np.int64)
+    keep = playable & (cols < total_columns)
+    fret_grid[strings[keep] - 1, cols[keep]] = frets[keep]
+
+    return top, rh, lh, chord_idx, fret_grid, int(playable.sum())
+
+
+def _sweep_all(starts, pitches, beat_duration, total_beats, total_columns,
+               chord_masks, tuning):
+    """
+    融合掃描：一趟掃過已排序的音符陣列，同時算出每拍的
+    最高音（旋律）、右手最高音（>= C4）、左手最低音（< C4）、
+    和弦索引，以及六線譜的 (6, 總拍格) 品位網格與可彈音符數。
+
+    兩指標掃描 + 整數 popcount，三種譜共用同一次記憶體巡訪；
+    -1 代表該拍沒有對應的音（和弦索引 -1 = 無和弦、品位 -1 = 空格）。
+    """
+    top = np.full(total_beats, -1, dtype=np.int16)
+    rh = np.full(total_beats, -1, dtype=np.int16)
+    lh = np.full(total_beats, -1, dtype=np.int16)
+    chord_idx = np.full(total_beats, -1, dtype=np.int8)
+    fret_grid = np.full((6, total_columns), -1, dtype=np.int8)
+    playable_count = 0
+
+    n = starts.shape[0]
+    i = 0
+    for b in range(total_beats):
+        limit = (b + 1) * beat_duration
+        mask = np.int64(0)
+
+        while i < n and starts[i] < limit:
+            p = pitches[i]
+            if p > top[b]:
+                top[b] = p
+            if p >= 60 and p > rh[b]:
+                rh[b] = p
+            if p < 60 and (lh[b] == -1 or p < lh[b]):
+                lh[b] = p
+            mask |= np.int64(1) << (p % 12)
+
+            # 弦品映射：挑最低可彈品位（與純量版同樣的平手取捨）
+            best_s = -1
+            best_f = 127
+            for s in range(6):
+                f = p - tuning[s]
+                if 0 <= f <= 24 and f < best_f:
+                    best_s = s
+                    best_f = f
+            if best_s >= 0:
+                playable_count += 1
+                col = np.int64(starts[i] / beat_duration)
+                if col < total_columns:
+                    fret_grid[best_s, col] = best_f
+
+            i += 1
+
+        if mask != 0:
+            best = -1
+            best_score = 0
+            for j in range(chord_masks.shape[0]):
+                m = mask & np.int64(chord_masks[j])
+                score = 0
+                while m:
+                    m &= m - 1  # 每次清掉最低位的 1
+                    score += 1
+                if score > best_score:
+                    best_score = score
+                    best = j
+            if best_score >= 2:
+                chord_idx[b] = best
+
+    return top, rh, lh, chord_idx, fret_grid, playable_count
+
+
+if njit is not None:
+    # nogil：三種譜平行產生時，掃描核心不佔著 GIL
+    _sweep_all = njit(cache=True, nogil=True)(_sweep_all)
+else:
+    _sweep_all = _sweep_all_np
+
+
+@lru_cache(maxsize=16)
+def _load_midi(midi_path: str, mtime: float):
+    """
+    解析 MIDI 檔一次，回傳 (starts, pitches, ends, tempo, end_time)。
+
+    三種產譜函式通常會對同一個檔案連續呼叫，解析結果以
+    (路徑, 修改時間) 為鍵快取，檔案沒變就不必重新解析；
+    音符已攤平成按開始時間排序的 NumPy 陣列。
+
+    解析後端依序嘗試 symusic → pretty_midi，下游拿到的陣列相同。
+    """
+    if symusic is not None:
+        return _load_midi_symusic(midi_path)
+    return _load_midi_pretty(midi_path)
+
+
+def _load_midi_symusic(midi_path: str):
+    """symusic 後端：直接以秒為時間單位解析，音符陣列整批取出。"""
+    score = symusic.Score(midi_path, ttype="second")
+
+    starts_list, pitches_list, ends_list = [], [], []
+    for track in score.tracks:
+        if track.is_drum:
+            continue
+        arr = track.notes.numpy()
+        starts_list.append(arr["time"].astype(np.float64))
+        pitches_list.append(arr["pitch"].astype(np.int16))
+        ends_list.append((arr["time"] + arr["duration"]).astype(np.float64))
+
+    if starts_list and sum(len(a) for a in starts_list):
+        starts = np.concatenate(starts_list)
+        pitches = np.concatenate(pitches_list)
+        ends = np.concatenate(ends_list)
+        order = np.argsort(starts, kind="stable")
+        starts, pitches, ends = starts[order], pitches[order], ends[order]
+        # 速度取檔案裡的 tempo 事件，沒有就套預設值
+        tempo = score.tempos[0].qpm if score.tempos else 120
+    else:
+        starts = np.empty(0)
+        pitches = np.empty(0, dtype=np.int16)
+        ends = np.empty(0)
+        tempo = 120
+
+    return starts, pitches, ends, float(tempo), float(score.end())
+
+
+def _load_midi_pretty(midi_path: str):
+    """pretty_midi 後援：逐音符攤平，速度用 estimate_tempo() 估。"""
+    midi = pretty_midi.PrettyMIDI(midi_path)
+
+    rows = [
+        (note.start, note.pitch, note.end)
+        for instrument in midi.instruments
+        if not instrument.is_drum
+        for note in instrument.notes
+    ]
+
+    if rows:
+        starts = np.array([r[0] for r in rows])
+        pitches = np.array([r[1] for r in rows], dtype=np.int16)
+        ends = np.array([r[2] for r in rows])
+        order = np.argsort(starts, kind="stable")
+        starts, pitches, ends = starts[order], pitches[order], ends[order]
+        tempo = midi.estimate_tempo() or 120  # 預設值只在這裡套一次
+    else:
+        starts = np.empty(0)
+        pitches = np.empty(0, dtype=np.int16)
+        ends = np.empty(0)
+        tempo = 120
+
+    return starts, pitches, ends, tempo, midi.get_end_time()
 
 
 def midi_note_to_guitar_fret(midi_note: int) -> Optional[tuple[int, int]]:
@@ -134,207 +389,229 @@ def midi_note_to_guitar_fret(midi_note: int) -> Optional[tuple[int, int]]:
     return None
 
 
-def generate_chord_sheet(midi_path: str, key_offset: int = 0) -> dict:
+def midi_note_to_guitar_fret_vec(pitches: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    從 MIDI 檔案產生彈唱簡譜。
-
-    包含：
-    - 旋律線（數字簡譜 1234567）
-    - 和弦標記（Am, G, C 等）
+    向量化版 midi_note_to_guitar_fret：一次映射整個音高陣列。
 
-    Args:
-        midi_path: MIDI 檔案路徑
-        key_offset: 調號偏移
+    frets_mat[i, s] = 第 i 個音在第 s 弦上的品位；不在 0-24 品內的
+    設成 127，argmin 就會挑出最低可彈品位（與純量版同樣的平手取捨）。
 
     Returns:
-        dict: 包含簡譜內容
+        tuple: (弦號 1-6, 品號, 可彈遮罩)，前兩者對不可彈的音無意義
     """
-    try:
-        midi = pretty_midi.PrettyMIDI(midi_path)
-    except Exception as e:
-        return {"success": False, "error": f"無法讀取 MIDI: {str(e)}"}
+    frets_mat = pitches[:, None] - _TUNING[None, :]
+    frets_mat[(frets_mat < 0) | (frets_mat > 24)] = 127
+    best_string = frets_mat.argmin(axis=1)
+    best_fret = frets_mat[np.arange(len(pitches)), best_string]
+    return best_string + 1, best_fret, best_fret <= 24
 
-    result_lines = []
-    chord_line = []
-    melody_line = []
 
-    # 取得所有音符並按時間排序
-    all_notes = []
-    for instrument in midi.instruments:
-        if not instrument.is_drum:
-            for note in instrument.notes:
-                all_notes.append(note)
-
-    all_notes.sort(key=lambda n: n.start)
-
-    if not all_notes:
-        return {"success": False, "error": "MIDI 檔案中沒有音符"}
-
-    # 以拍為單位分組（假設 120 BPM，每拍 0.5 秒）
-    tempo = midi.estimate_tempo() or 120
-    beat_duration = 60.0 / tempo
-    total_duration = midi.get_end_time()
-
-    current_beat = 0
-    beat_time = 0.0
-
-    measures = []
-    current_measure_melody = []
-    current_measure_chords = []
+def _group_measures(melody_numbers: list[str], chord_idx_list: list[int]) -> tuple[list, list]:
+    """把逐拍的旋律簡譜與和弦索引切成 4 拍一組的小節。"""
     beats_per_measure = 4
+    beat_chords = ["" if c < 0 else CHORD_NAMES[c] for c in chord_idx_list]
+
+    measures = [
+        {
+            "melody": melody_numbers[m:m + beats_per_measure],
+            "chords": beat_chords[m:m + beats_per_measure],
+        }
+        for m in range(0, len(melody_numbers), beats_per_measure)
+    ]
+    # 輸出階段比對用的和弦索引（-1 = 無和弦），免去逐拍字串比較
+    measure_chord_idx = [
+        chord_idx_list[m:m + beats_per_measure]
+        for m in range(0, len(chord_idx_list), beats_per_measure)
+    ]
+    return measures, measure_chord_idx
 
-    while beat_time < total_duration:
-        beat_end = beat_time + beat_duration
-
-        # 找到這一拍內的音符
-        beat_notes = [n for n in all_notes if n.start >= beat_time and n.start < beat_end]
-
-        if beat_notes:
-            # 旋律：取最高音
-            melody_note = max(beat_notes, key=lambda n: n.pitch)
-            numbered = midi_note_to_numbered(melody_note.pitch, key_offset)
-            current_measure_melody.append(numbered)
-
-            # 和弦：從所有音符中辨識
-            chord = detect_chord([n.pitch for n in beat_notes])
-            current_measure_chords.append(chord)
-        else:
-            current_measure_melody.append("-")
-            current_measure_chords.append("")
-
-        current_beat += 1
-
-        if current_beat >= beats_per_measure:
-            measures.append({
-                "melody": current_measure_melody,
-                "chords": current_measure_chords,
-            })
-            current_measure_melody = []
-            current_measure_chords = []
-            current_beat = 0
-
-        beat_time = beat_end
-
-    # 處理最後不完整的小節
-    if current_measure_melody:
-        measures.append({
-            "melody": current_measure_melody,
-            "chords": current_measure_chords,
-        })
-
-    # 格式化輸出
+
+def _format_chord_sheet(measures: list, measure_chord_idx: list,
+                        tempo: float, key_offset: int) -> str:
+    """把小節資料排版成簡譜文字（唯一留在 Python 的輸出階段）。"""
     output_lines = []
     output_lines.append(f"速度: ♩ = {int(tempo)}")
     output_lines.append(f"調號: {NOTE_NAMES[key_offset % 12]} 大調")
     output_lines.append("")
 
-    for i, measure in enumerate(measures):
-        # 和弦行
+    for i, (measure, idx_row) in enumerate(zip(measures, measure_chord_idx)):
+        # 和弦行（比整數索引就好，不必逐拍比字串）
         chord_display = []
-        last_chord = ""
-        for ch in measure["chords"]:
-            if ch and ch != last_chord:
-                chord_display.append(f"[{ch}]")
-                last_chord = ch
+        last_idx = -1
+        for ci in idx_row:
+            if ci != -1 and ci != last_idx:
+                chord_display.append(f"[{CHORD_NAMES[ci]}]")
+                last_idx = ci
             else:
                 chord_display.append("    ")
 
-        # 旋律行
-        melody_display = " ".join(f"{m:>3}" for m in measure["melody"])
+        # 旋律行（右靠補齊交給 np.char 一次做完）
+        melody_display = " ".join(np.char.rjust(np.asarray(measure["melody"]), 3).tolist())
 
-        chord_str = " ".join(f"{c:>5}" for c in chord_display)
+        chord_str = " ".join(np.char.rjust(np.asarray(chord_display), 5).tolist())
         output_lines.append(chord_str)
         output_lines.append(melody_display)
 
         if (i + 1) % 4 == 0:
             output_lines.append("")  # 每 4 小節空一行
 
-    return {
-        "success": True,
-        "content": "\n".join(output_lines),
-        "measures": measures,
-        "tempo": int(tempo),
-        "key": NOTE_NAMES[key_offset % 12],
-    }
+    return "\n".join(output_lines)
 
 
-def generate_fingerstyle_tab(midi_path: str) -> dict:
+class TabEngine:
     """
-    從 MIDI 檔案產生指彈六線譜。
+    以單一 MIDI 檔為單位的產譜引擎。
+
+    建構時解析一次（經 _load_midi 快取），音符陣列、速度與總長
+    存在實例上，三種譜的方法直接共用這份狀態，不再各自開檔。
+    """
+
+    def __init__(self, midi_path: str):
+        self.midi_path = midi_path
+        self.starts, self.pitches, self.ends, self.tempo, self.end_time = _load_midi(
+            midi_path, os.path.getmtime(midi_path)
+        )
+        self.beat_duration = 60.0 / self.tempo
+        self.total_beats = max(1, int(np.ceil(self.end_time / self.beat_duration)))
+
+    def _sweep(self, total_columns: int):
+        """跑一次融合掃描核心（所有方法共用同一組輸入陣列）。"""
+        return _sweep_all(
+            self.starts, self.pitches, self.beat_duration,
+            self.total_beats, total_columns, CHORD_MASKS, _TUNING,
+        )
+
+    def chord_sheet(self, key_offset: int = 0) -> dict:
+        """產生彈唱簡譜：旋律線（數字簡譜）加和弦標記。"""
+        if self.starts.size == 0:
+            return {"success": False, "error": "MIDI 檔案中沒有音符"}
+
+        melody_pitches, _, _, chord_idx, _, _ = self._sweep(self.total_beats)
+        melody_numbers = midi_notes_to_numbered(melody_pitches, key_offset)
+        measures, measure_chord_idx = _group_measures(melody_numbers, chord_idx.tolist())
+
+        return {
+            "success": True,
+            "content": _format_chord_sheet(
+                measures, measure_chord_idx, self.tempo, key_offset
+            ),
+            "measures": measures,
+            "tempo": int(self.tempo),
+            "key": NOTE_NAMES[key_offset % 12],
+        }
+
+    def fingerstyle_tab(self) -> dict:
+        """產生指彈六線譜：品位網格由融合掃描核心一趟算出。"""
+        total_columns = int(self.end_time / self.beat_duration) + 1
+        _, _, _, _, fret_grid, playable_count = self._sweep(total_columns)
+
+        if playable_count == 0:
+            return {"success": False, "error": "沒有可轉換為吉他譜的音符"}
+
+        # 數字網格換成右靠滿 2 字元的字串（-1 = 空格），輸出時就只剩 join
+        grid = np.where(fret_grid >= 0, np.char.rjust(fret_grid.astype("U2"), 2), " -")
+
+        # 格式化輸出（每行顯示 32 拍）
+        output_lines = []
+        output_lines.append(f"速度: ♩ = {int(self.tempo)}")
+        output_lines.append(f"Tuning: Standard (EADGBE)")
+        output_lines.append("")
+
+        chunk_size = 32
+        for chunk_start in range(0, total_columns, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, total_columns)
+
+            for string_num in range(1, 7):
+                string_name = GUITAR_STRING_NAMES[string_num - 1]
+                cells = grid[string_num - 1, chunk_start:chunk_end]
+                line = f"{string_name}|" + "-".join(cells.tolist()) + "|"
+                output_lines.append(line)
+
+            output_lines.append("")  # 段落間空行
+
+        return {
+            "success": True,
+            "content": "\n".join(output_lines),
+            "tempo": int(self.tempo),
+            "total_notes": int(playable_count),
+        }
+
+    def piano_sheet(self, key_offset: int = 0) -> dict:
+        """產生鋼琴簡譜：右手取每拍 C4 以上最高音、左手取 C4 以下最低音。"""
+        if self.starts.size == 0:
+            return {"success": False, "error": "MIDI 檔案中沒有音符"}
+
+        _, rh_pitch, lh_pitch, _, _, _ = self._sweep(self.total_beats)
+
+        right_hand = midi_notes_to_numbered(rh_pitch, key_offset)
+        left_hand = midi_notes_to_numbered(lh_pitch, key_offset)
+
+        # 格式化
+        output_lines = [
+            f"速度: ♩ = {int(self.tempo)}",
+            f"調號: {NOTE_NAMES[key_offset % 12]} 大調",
+            "",
+            "右手（旋律）：",
+        ]
+
+        # 每 16 拍一行；整行右靠補齊用 np.char 批次做
+        rh_cells = np.char.rjust(np.asarray(right_hand), 3)
+        for i in range(0, len(right_hand), 16):
+            output_lines.append(" ".join(rh_cells[i:i + 16].tolist()))
+
+        output_lines.append("")
+        output_lines.append("左手（伴奏）：")
+
+        lh_cells = np.char.rjust(np.asarray(left_hand), 3)
+        for i in range(0, len(left_hand), 16):
+            output_lines.append(" ".join(lh_cells[i:i + 16].tolist()))
+
+        return {
+            "success": True,
+            "content": "\n".join(output_lines),
+            "tempo": int(self.tempo),
+            "key": NOTE_NAMES[key_offset % 12],
+        }
+
+
+# ── 模組層 API（相容舊呼叫方式的薄包裝）──
+def generate_chord_sheet(midi_path: str, key_offset: int = 0) -> dict:
+    """
+    從 MIDI 檔案產生彈唱簡譜。
+
+    包含：
+    - 旋律線（數字簡譜 1234567）
+    - 和弦標記（Am, G, C 等）
 
     Args:
         midi_path: MIDI 檔案路徑
+        key_offset: 調號偏移
 
     Returns:
-        dict: 包含六線譜內容
+        dict: 包含簡譜內容
     """
     try:
-        midi = pretty_midi.PrettyMIDI(midi_path)
+        engine = TabEngine(midi_path)
     except Exception as e:
         return {"success": False, "error": f"無法讀取 MIDI: {str(e)}"}
+    return engine.chord_sheet(key_offset)
 
-    # 收集所有非鼓的音符
-    all_notes = []
-    for instrument in midi.instruments:
-        if not instrument.is_drum:
-            for note in instrument.notes:
-                fret_info = midi_note_to_guitar_fret(note.pitch)
-                if fret_info:
-                    all_notes.append({
-                        "pitch": note.pitch,
-                        "start": note.start,
-                        "end": note.end,
-                        "string": fret_info[0],
-                        "fret": fret_info[1],
-                    })
-
-    all_notes.sort(key=lambda n: n["start"])
-
-    if not all_notes:
-        return {"success": False, "error": "沒有可轉換為吉他譜的音符"}
-
-    # 建立六線譜
-    tempo = midi.estimate_tempo() or 120
-    beat_duration = 60.0 / tempo
-    total_duration = midi.get_end_time()
-    total_columns = int(total_duration / beat_duration) + 1
-
-    # 初始化六條弦的陣列
-    tab_lines = {i: [] for i in range(1, 7)}  # 弦 1-6
-    for string_num in range(1, 7):
-        tab_lines[string_num] = ["-"] * total_columns
-
-    # 填入音符
-    for note in all_notes:
-        col = int(note["start"] / beat_duration)
-        if col < total_columns:
-            fret_str = str(note["fret"])
-            tab_lines[note["string"]][col] = fret_str
-
-    # 格式化輸出（每行顯示 32 拍）
-    output_lines = []
-    output_lines.append(f"速度: ♩ = {int(tempo)}")
-    output_lines.append(f"Tuning: Standard (EADGBE)")
-    output_lines.append("")
-
-    chunk_size = 32
-    for chunk_start in range(0, total_columns, chunk_size):
-        chunk_end = min(chunk_start + chunk_size, total_columns)
 
-        for string_num in range(1, 7):
-            string_name = GUITAR_STRING_NAMES[string_num - 1]
-            frets = tab_lines[string_num][chunk_start:chunk_end]
-            line = f"{string_name}|" + "-".join(f"{f:>2}" for f in frets) + "|"
-            output_lines.append(line)
+def generate_fingerstyle_tab(midi_path: str) -> dict:
+    """
+    從 MIDI 檔案產生指彈六線譜。
 
-        output_lines.append("")  # 段落間空行
+    Args:
+        midi_path: MIDI 檔案路徑
 
-    return {
-        "success": True,
-        "content": "\n".join(output_lines),
-        "tempo": int(tempo),
-        "total_notes": len(all_notes),
-    }
+    Returns:
+        dict: 包含六線譜內容
+    """
+    try:
+        engine = TabEngine(midi_path)
+    except Exception as e:
+        return {"success": False, "error": f"無法讀取 MIDI: {str(e)}"}
+    return engine.fingerstyle_tab()
 
 
 def generate_piano_sheet(midi_path: str, key_offset: int = 0) -> dict:
@@ -349,74 +626,35 @@ def generate_piano_sheet(midi_path: str, key_offset: int = 0) -> dict:
         dict: 包含鋼琴簡譜內容
     """
     try:
-        midi = pretty_midi.PrettyMIDI(midi_path)
+        engine = TabEngine(midi_path)
     except Exception as e:
         return {"success": False, "error": f"無法讀取 MIDI: {str(e)}"}
+    return engine.piano_sheet(key_offset)
 
-    all_notes = []
-    for instrument in midi.instruments:
-        if not instrument.is_drum:
-            for note in instrument.notes:
-                all_notes.append(note)
-
-    all_notes.sort(key=lambda n: n.start)
-
-    if not all_notes:
-        return {"success": False, "error": "MIDI 檔案中沒有音符"}
-
-    tempo = midi.estimate_tempo() or 120
-    beat_duration = 60.0 / tempo
-    total_duration = midi.get_end_time()
-
-    # 分為右手（高音）和左手（低音）
-    right_hand = []
-    left_hand = []
-
-    beat_time = 0.0
-    while beat_time < total_duration:
-        beat_end = beat_time + beat_duration
-        beat_notes = [n for n in all_notes if n.start >= beat_time and n.start < beat_end]
-
-        rh_notes = [n for n in beat_notes if n.pitch >= 60]  # C4 以上
-        lh_notes = [n for n in beat_notes if n.pitch < 60]   # C4 以下
-
-        if rh_notes:
-            top = max(rh_notes, key=lambda n: n.pitch)
-            right_hand.append(midi_note_to_numbered(top.pitch, key_offset))
-        else:
-            right_hand.append("-")
-
-        if lh_notes:
-            bottom = min(lh_notes, key=lambda n: n.pitch)
-            left_hand.append(midi_note_to_numbered(bottom.pitch, key_offset))
-        else:
-            left_hand.append("-")
-
-        beat_time = beat_end
-
-    # 格式化
-    output_lines = [
-        f"速度: ♩ = {int(tempo)}",
-        f"調號: {NOTE_NAMES[key_offset % 12]} 大調",
-        "",
-        "右手（旋律）：",
-    ]
 
-    # 每 16 拍一行
-    for i in range(0, len(right_hand), 16):
-        chunk = right_hand[i:i + 16]
-        output_lines.append(" ".join(f"{n:>3}" for n in chunk))
+def generate_all(midi_path: str, key_offset: int = 0) -> dict:
+    """
+    一次產生三種樂譜。
 
-    output_lines.append("")
-    output_lines.append("左手（伴奏）：")
-
-    for i in range(0, len(left_hand), 16):
-        chunk = left_hand[i:i + 16]
-        output_lines.append(" ".join(f"{n:>3}" for n in chunk))
-
-    return {
-        "success": True,
-        "content": "\n".join(output_lines),
-        "tempo": int(tempo),
-        "key": NOTE_NAMES[key_offset % 12],
-    }
+    三種譜是同一個 TabEngine 實例上的獨立計算，解析只發生在建構時，
+    之後丟進執行緒池平行跑 —— 重活都在 NumPy 或 nogil 的 numba
+    核心裡，三條執行緒幾乎可以線性疊加。
+
+    Returns:
+        dict: {"chord_sheet": ..., "fingerstyle_tab": ..., "piano_sheet": ...}
+    """
+    try:
+        engine = TabEngine(midi_path)
+    except Exception as e:
+        error = {"success": False, "error": f"無法讀取 MIDI: {str(e)}"}
+        return {"chord_sheet": error, "fingerstyle_tab": error, "piano_sheet": error}
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        chord_future = pool.submit(engine.chord_sheet, key_offset)
+        tab_future = pool.submit(engine.fingerstyle_tab)
+        piano_future = pool.submit(engine.piano_sheet, key_offset)
+        return {
+            "chord_sheet": chord_future.result(),
+            "fingerstyle_tab": tab_future.result(),
+            "piano_sheet": piano_future.result(),
+        }